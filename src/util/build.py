@@ -35,8 +35,8 @@ def log(message, error=False, info=False):
         print(colors.OKGREEN + message)
 
 
-def get_graph(filename=PUBLIC_ONTOLOGY_FILEPATH):
-    g = Graph()
+def get_graph(filename=PUBLIC_ONTOLOGY_FILEPATH, store="default"):
+    g = Graph(store=store)
     g.parse(filename)
     log(filename)
     log(f"The graph has {len(g)} triples", info=True)
@@ -1,5 +1,4 @@
-from update_attack import get_stix_data, update_and_add
-from stix2 import MemoryStore, Filter
+from update_attack import get_stix_data, load_stix_objects, update_and_add
 from rdflib import URIRef, Literal, Graph, RDF, RDFS, Namespace
 from build import get_graph, _xmlns as _XMLNS
 
@@ -67,9 +66,9 @@ def test_cases(src, g):
     """
     Test cases for updating labels and removing deprecated & revoked techniques
     Here are all the cases covered:
-    -Getting all techniques & subtechniques using stix2
-    -Getting all deprecated techniques & subtechniques using stix2
-    -Getting all revoked techniques and subtechniques using stix2
+    -Getting all techniques & subtechniques from the stix bundle
+    -Getting all deprecated techniques & subtechniques from the stix bundle
+    -Getting all revoked techniques and subtechniques from the stix bundle
     -Adding new techniques & subtechniques
     -Adding new deprecated technique & subtechnique
     -Adding new revoked technique & subtechnique
@@ -96,7 +95,7 @@ def test_cases(src, g):
     """
 
     
-    # Test Case for getting techniques using stix2
+    # Test Case for getting techniques from the stix bundle
 
     techs = get_stix_data(src, g)
 
@@ -172,8 +171,7 @@ def test_cases(src, g):
     _assert(g.value(URIRef(_XMLNS + "T1066"), RDFS.comment), Literal(f"This technique has been revoked by T1027.005"))
 
 def main():
-    src = MemoryStore()
-    src.load_from_file("src/util/test_cases.json")
+    src = load_stix_objects("src/util/test_cases.json")
     g = Graph()
     g.parse(data=test_graph, format="turtle")
     test_cases(src, g)
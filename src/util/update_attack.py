@@ -1,7 +1,8 @@
-from stix2 import MemoryStore, Filter
 from rdflib import URIRef, Literal, RDF, RDFS, Namespace
 from build import get_graph, _xmlns as _XMLNS
+from functools import lru_cache
 from pathlib import Path
+import json
 import string
 import sys
 
@@ -10,30 +11,65 @@ owl = Namespace('http://www.w3.org/2002/07/owl#')
 rdfs = Namespace('http://www.w3.org/2000/01/rdf-schema#')
 d3fend = Namespace("http://d3fend.mitre.org/ontologies/d3fend.owl#")
 
+# Terms used for every technique, built once instead of on each namespace lookup
+RDF_TYPE = RDF.type
+RDFS_LABEL = RDFS.label
+RDFS_SUBCLASS_OF = RDFS.subClassOf
+RDFS_COMMENT = rdfs.comment
+RDFS_SEE_ALSO = rdfs.seeAlso
+OWL_CLASS = owl.Class
+OWL_DEPRECATED = owl.deprecated
+D3F_ATTACK_ID = d3fend['attack-id']
+D3F_DEFINITION = d3fend['definition']
+# Literal(True) infers its xsd:boolean datatype on every construction, so share one
+LITERAL_TRUE = Literal(True)
+
 def _print(*args):
     print(" ".join([str(a) for a in args]).rjust(80, " "))
     print()
 
+# Returns the d3fend URI for a superclass name
+# Tactic classes and parent techniques recur across many techniques, so cache them
+@lru_cache(maxsize=None)
+def _d3f(name):
+    return d3fend[name]
+
+# Returns the first paragraph of a stix description without splitting the rest
+def _first_line(description):
+    return description.partition("\n")[0]
+
+# Returns the ATT&CK id from a stix object's external references, or None
+# Stops at the first mitre-attack reference so each list is walked at most once
+def get_attack_id(stix_obj):
+    for ref in stix_obj["external_references"]:
+        if ref.get("source_name") == "mitre-attack":
+            return ref.get("external_id")
+    return None
+
 # Parses data in enterprise-attack.json and returns list of techniques with following annotations:
 #   id: attack id
 #   superclasses: superclass, list of superclasses if not subtechnique
 #   label: technique name
+#   current_label: rdfs:label currently in d3fend graph, None if missing
 #   missing: is tech missing from d3fend graph
 #   label_change: does tech's label need updating
 #   deprecated: if tech is deprecated
 #   revoked: if tech is revoked
 #   revoked_by: tech revoked technique is revoked by 
-def get_stix_data(thesrc, graph):
+def get_stix_data(stix_objects, graph):
     data = []
-    query_results = thesrc.query([Filter('type', '=', 'attack-pattern')])
+    query_results, revoked_relationships = partition_stix_objects(stix_objects)
     superclasses_dict = generate_superclass(query_results)
+    # Index stix ids to ATT&CK ids once so revoked-by targets resolve without a scan
+    attack_ids = {tech["id"]: get_attack_id(tech) for tech in query_results}
+    revoked_by_dict = get_revoked_by(revoked_relationships)
     for tech in query_results:
         deprecated = tech.get("x_mitre_deprecated", False)
         revoked = tech.get("revoked", False)
-        attack_id = next((ref.get("external_id") for ref in tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
+        attack_id = attack_ids[tech["id"]]
         superclasses = superclasses_dict[attack_id]
         attack_uri = URIRef(_XMLNS + attack_id)
-        current_label = graph.value(attack_uri, RDFS.label)
+        current_label = graph.value(attack_uri, RDFS_LABEL)
         label_change = False
 
         if (current_label != None):
@@ -41,16 +77,15 @@ def get_stix_data(thesrc, graph):
 
         revoked_by_id = ""
         if revoked:
-            revoked_by_dict = get_revoked_by(thesrc)
             revoked_by = revoked_by_dict[tech["id"]]
-            revoked_by_tech = [obj for obj in query_results if obj.get("id") == revoked_by][0]
-            revoked_by_id = next((ref.get("external_id") for ref in revoked_by_tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
+            revoked_by_id = attack_ids[revoked_by]
         
         entry = {
             "data": tech,
             "id": attack_id,
             "superclasses": superclasses,
             "label": tech["name"], 
+            "current_label": current_label,
             "missing": current_label == None, 
             "label_change": label_change,
             "deprecated": deprecated, 
@@ -63,50 +98,65 @@ def get_stix_data(thesrc, graph):
     
 # Adds deprecated annotations to techniques in d3fend graph
 def add_deprecated(graph, tech):
+    attack_id = tech["id"]
     tech = tech["data"]
-    attack_id = next((ref.get("external_id") for ref in tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
     attack_uri = URIRef(_XMLNS + attack_id)
     new = 0
 
     if (None, None, Literal(attack_id)) in graph:
-        deprecated_property = graph.value(attack_uri, owl.deprecated)
+        deprecated_property = graph.value(attack_uri, OWL_DEPRECATED)
         # Check if tech already has deprecated annotations
         if deprecated_property is None:
             new = 1
             # Add a triple indicating deprecation
-            graph.add((attack_uri, owl.deprecated, Literal(True)))
-            graph.add((attack_uri, rdfs.comment, Literal(tech["description"].split("\n")[0])))
+            graph.add((attack_uri, OWL_DEPRECATED, LITERAL_TRUE))
+            graph.add((attack_uri, RDFS_COMMENT, Literal(_first_line(tech["description"]))))
     return new
 
 # Adds revoked annotations to techniques in d3fend graph
 def add_revoked(graph, tech):
     revoked_by = tech["revoked_by"]
+    attack_id = tech["id"]
     tech = tech["data"]
-    attack_id = next((ref.get("external_id") for ref in tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
     attack_uri = URIRef(_XMLNS + attack_id)
     new = 0
 
     if (None, None, Literal(attack_id)) in graph:
-        revoked_property = graph.value(attack_uri, owl.deprecated)
+        revoked_property = graph.value(attack_uri, OWL_DEPRECATED)
         # Check if tech already has revoked annotations
         if revoked_property is None:
             new = 1
             # Add a triple indicating deprecation
-            graph.add((attack_uri, rdfs.seeAlso, Literal(revoked_by)))
-            graph.add((attack_uri, owl.deprecated, Literal(True)))
-            graph.add((attack_uri, rdfs.comment, Literal(f"This technique has been revoked by {revoked_by}")))
+            graph.add((attack_uri, RDFS_SEE_ALSO, Literal(revoked_by)))
+            graph.add((attack_uri, OWL_DEPRECATED, LITERAL_TRUE))
+            graph.add((attack_uri, RDFS_COMMENT, Literal(f"This technique has been revoked by {revoked_by}")))
     return new
 
+# Returns the objects of a stix bundle as plain dicts
+# Only a handful of fields are read, so skip building and validating stix2 objects
+def load_stix_objects(filename):
+    with open(filename, encoding="utf-8") as f:
+        return json.load(f)["objects"]
+
+# Splits the stix objects in enterprise-attack.json into attack patterns and
+# revoked-by relationships with a single scan
+def partition_stix_objects(stix_objects):
+    techniques = []
+    revoked_relationships = []
+    for obj in stix_objects:
+        obj_type = obj["type"]
+        if obj_type == "attack-pattern":
+            techniques.append(obj)
+        elif obj_type == "relationship" and obj["relationship_type"] == "revoked-by":
+            revoked_relationships.append(obj)
+    return techniques, revoked_relationships
+
 # Returns a dictionary of which technique was revoked by another technique 
-# Parses relationship objects in enterprise-attack.json
-def get_revoked_by(thesrc):
+# Parses revoked-by relationship objects in enterprise-attack.json
+def get_revoked_by(relationships):
     revoked_by = {}
-    relationships = thesrc.query([
-        Filter('type', '=', 'relationship'),
-        Filter('relationship_type', '=', 'revoked-by'),
-    ])
     for relationship in relationships:
-        revoked_by[relationship.source_ref] = relationship.target_ref
+        revoked_by[relationship["source_ref"]] = relationship["target_ref"]
     
     return revoked_by
 
@@ -115,14 +165,20 @@ def get_revoked_by(thesrc):
 # If technique, superclass is tactic or list of tactics
 def generate_superclass(all_techniques):
     superclass = {}
+    # Tactic class names by kill chain phase, since only a dozen or so phases recur
+    phase_classes = {}
     for tech in all_techniques:
-        attack_id = next((ref.get("external_id") for ref in tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
+        attack_id = get_attack_id(tech)
         if tech["x_mitre_is_subtechnique"]:
-            superclass[attack_id] = attack_id.split(".")[0]
+            superclass[attack_id] = attack_id.partition(".")[0]
         else:
             classes = []
             for obj in tech["kill_chain_phases"]:
-                name = str(string.capwords(obj["phase_name"].replace("-", " ")) + " Technique").replace(" ", "")
+                phase_name = obj["phase_name"]
+                name = phase_classes.get(phase_name)
+                if name is None:
+                    name = f"{string.capwords(phase_name.replace('-', ' ')).replace(' ', '')}Technique"
+                    phase_classes[phase_name] = name
                 classes.append(name)
             superclass[attack_id] = classes
 
@@ -142,62 +198,50 @@ def add_to_ttl(tech, graph):
     revoked_by = tech["revoked_by"]
     subtechnique = tech["data"]["x_mitre_is_subtechnique"]
     attack_uri = URIRef(_XMLNS + attack_id)
-    key = ""
+    # Every case starts with the same class, label, subClassOf and attack-id triples
+    quads = [
+        (attack_uri, RDF_TYPE, OWL_CLASS, graph),
+        (attack_uri, RDFS_LABEL, Literal(name), graph),
+    ]
+    if subtechnique:
+        quads.append((attack_uri, RDFS_SUBCLASS_OF, _d3f(subclass), graph))
+    else:
+        # Handle multiple superclasses 
+        for subclass_of in subclass:
+            quads.append((attack_uri, RDFS_SUBCLASS_OF, _d3f(subclass_of), graph))
+    quads.append((attack_uri, D3F_ATTACK_ID, Literal(attack_id), graph))
 
     if tech["deprecated"]:
-        graph.add((attack_uri, RDF.type, owl.Class))
-        graph.add((attack_uri, RDFS.label, Literal(name)))
-        if subtechnique:
-            graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass]))
-        else:
-            # Handle multiple superclasses 
-            for subclass_of in subclass:
-                graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass_of]))
-        graph.add((attack_uri, d3fend['attack-id'], Literal(attack_id)))
-        graph.add((attack_uri, owl.deprecated, Literal(True)))
-        graph.add((attack_uri, rdfs.comment, Literal(tech["data"]["description"].split("\n")[0])))
+        quads.append((attack_uri, OWL_DEPRECATED, LITERAL_TRUE, graph))
+        quads.append((attack_uri, RDFS_COMMENT, Literal(_first_line(tech["data"]["description"])), graph))
         key = "missing_deprecated"
 
     elif tech["revoked"]:
-        graph.add((attack_uri, RDF.type, owl.Class))
-        graph.add((attack_uri, RDFS.label, Literal(name)))
-        if subtechnique:
-            graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass]))
-        else:
-            for subclass_of in subclass:
-                graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass_of]))
-        graph.add((attack_uri, d3fend['attack-id'], Literal(attack_id)))
-        graph.add((attack_uri, owl.deprecated, Literal(True)))
-        graph.add((attack_uri, rdfs.seeAlso, Literal(revoked_by)))
-        graph.add((attack_uri, rdfs.comment, Literal(f"This technique has been revoked by {revoked_by}")))
+        quads.append((attack_uri, OWL_DEPRECATED, LITERAL_TRUE, graph))
+        quads.append((attack_uri, RDFS_SEE_ALSO, Literal(revoked_by), graph))
+        quads.append((attack_uri, RDFS_COMMENT, Literal(f"This technique has been revoked by {revoked_by}"), graph))
         key = "missing_revoked"
 
     else:
-        graph.add((attack_uri, RDF.type, owl.Class))
-        graph.add((attack_uri, RDFS.label, Literal(name)))
-        if subtechnique:
-            graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass]))
-        else:
-            for subclass_of in subclass:
-                graph.add((attack_uri, RDFS.subClassOf, d3fend[subclass_of]))
-        graph.add((attack_uri, d3fend['attack-id'], Literal(attack_id)))
         key = "missing_neither"
+
+    graph.addN(quads)
     return key
 
 def update_definition(graph, tech):
+    attack_id = tech["id"]
     tech = tech["data"]
-    attack_id = next((ref.get("external_id") for ref in tech["external_references"] if ref.get("source_name") == "mitre-attack"), None)
     attack_uri = URIRef(_XMLNS + attack_id)
     new = 0
 
     if (None, None, Literal(attack_id)) in graph:
         
-        def_property = graph.value(attack_uri, d3fend['definition'])
+        def_property = graph.value(attack_uri, D3F_DEFINITION)
         # Check if tech already has definition
         if def_property is None:
             new = 1
             # Add definition
-            graph.add((attack_uri, d3fend['definition'], Literal(tech["description"].split('\n')[0])))
+            graph.add((attack_uri, D3F_DEFINITION, Literal(_first_line(tech["description"]))))
     return new
 
 def update_and_add(graph, data):
@@ -228,9 +272,8 @@ def update_and_add(graph, data):
                 counters["recently_revoked"] += new
             elif tech["label_change"]:
                 attack_uri = URIRef(_XMLNS + tech["id"])
-                current_label = graph.value(attack_uri, RDFS.label)
-                graph.remove((attack_uri, RDFS.label, current_label))
-                graph.add((attack_uri, RDFS.label, Literal(tech["label"])))
+                graph.remove((attack_uri, RDFS_LABEL, tech["current_label"]))
+                graph.add((attack_uri, RDFS_LABEL, Literal(tech["label"])))
                 counters["label_change"] += 1
         update_definition(graph, tech)
     
@@ -239,14 +282,16 @@ def update_and_add(graph, data):
 
 def main(do_counters=True, ATTACK_VERSION="13.1"):
 
-    src = MemoryStore()
-    src.load_from_file(f"data/enterprise-attack-{ATTACK_VERSION}.json")
-    d3fend_graph = get_graph(filename="src/ontology/d3fend-protege.updates.ttl")
+    stix_objects = load_stix_objects(f"data/enterprise-attack-{ATTACK_VERSION}.json")
+    # Nothing here reads named graphs, so skip the context-aware store's bookkeeping
+    d3fend_graph = get_graph(filename="src/ontology/d3fend-protege.updates.ttl", store="SimpleMemory")
     
-    data = get_stix_data(src, d3fend_graph) # parse stix data
+    data = get_stix_data(stix_objects, d3fend_graph) # parse stix data
     counters = update_and_add(d3fend_graph, data) # add new techniques and modify current ones 
 
-    d3fend_graph.serialize(destination="src/ontology/d3fend-protege.updates.ttl", format="turtle")
+    # Serialize with ttlser directly so the output is already ttlfmt-formatted
+    # and update_attack.sh need not parse and rewrite the whole file again
+    d3fend_graph.serialize(destination="src/ontology/d3fend-protege.updates.ttl", format="nifttl")
 
     if do_counters:
         # Print some stats 
@@ -25,8 +25,6 @@ echo -e "${GREEN}All test cases passed \n"
 
 pipenv run python src/util/update_attack.py "$ATTACK_VERSION" || exit 1
 
-pipenv run ttlfmt src/ontology/d3fend-protege.updates.ttl
-
 echo -e "${YELLOW}Created new ontology file with updates here: src/ontology/d3fend-protege.updates.ttl \n"
 echo -e "Please manually review and compare to: src/ontology/d3fend-protege.ttl \n"
 echo -e "If changes acceptable, replace files \n"